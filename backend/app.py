@@ -1,154 +1,386 @@
 import os
+import asyncio
+import json
+import time
+import hashlib
+import queue
+import atexit
 import sqlite3
-from flask import Flask, request, jsonify, g
-from flask_cors import CORS
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from quart import Quart, request, jsonify, g
+from quart_cors import cors
+from quart.json.provider import DefaultJSONProvider
 import jwt
-from datetime import datetime, timedelta
-from werkzeug.security import generate_password_hash, check_password_hash
+import orjson
+from jwt.algorithms import HMACAlgorithm
+from jwt.utils import base64url_encode, base64url_decode
+from cachetools import TTLCache
+from werkzeug.security import check_password_hash
+from argon2 import PasswordHasher
+from argon2.exceptions import VerificationError, InvalidHashError
+from db_init import apply_pragmas, POINTS_PER_COURSE
 
 DB = os.environ.get('SQLITE_DB', 'app.db')
 JWT_SECRET = os.environ.get('JWT_SECRET', 'dev-secret-change-me')
 JWT_ALGO = 'HS256'
+# tokens we issue are well under this; anything longer is rejected unparsed
+MAX_TOKEN_LENGTH = 512
+# threads available for blocking sqlite/argon2 work; each concurrent argon2 hash holds 64MiB
+THREADPOOL_SIZE = int(os.environ.get('THREADPOOL_SIZE', 32))
+# idle connections kept open; matching the thread count means every worker thread can
+# hold one without connections being opened and discarded under load
+POOL_SIZE = int(os.environ.get('SQLITE_POOL_SIZE', THREADPOOL_SIZE))
+# hot queries, kept as constants so every call hands sqlite the same statement text
+USER_BY_ID_SQL = 'SELECT id, username, email, points FROM users WHERE id = ?'
+RATINGS_AGG_SQL = 'SELECT course_id, AVG(rating) AS avg_rating, COUNT(*) AS count FROM ratings GROUP BY course_id'
+USER_ACTIVITY_SQL = (
+    "SELECT 'c' AS kind, course_id, completed_at AS ts, NULL AS rating FROM completions WHERE user_id = ? "
+    "UNION ALL SELECT 'r', course_id, NULL, rating FROM ratings WHERE user_id = ?"
+)
+COURSES_PATH = os.path.join(os.path.dirname(__file__), '..', 'src', 'data', 'courses.json')
 
-def get_db():
-    db = getattr(g, '_database', None)
-    if db is None:
-        db = g._database = sqlite3.connect(DB)
-        db.row_factory = sqlite3.Row
+# parsed courses.json, reloaded only when the file's mtime changes
+_courses_cache = None
+_courses_mtime = 0
+
+# HS256 signer built once: PyJWT's prepare_key is expensive and would otherwise run on
+# every encode/decode. Tokens always carry this exact header, so it is encoded once too.
+_jwt_alg = HMACAlgorithm(HMACAlgorithm.SHA256)
+_jwt_key = _jwt_alg.prepare_key(JWT_SECRET)
+_jwt_header = base64url_encode(json.dumps({'alg': JWT_ALGO, 'typ': 'JWT'}, separators=(',', ':'), sort_keys=True).encode())
+
+# verified tokens: sha256(token) -> (user_id, exp). Failed validations are never cached.
+_jwt_cache = TTLCache(maxsize=10000, ttl=30)
+_jwt_cache_lock = threading.Lock()
+
+# public user rows (plain dicts) keyed by user id; invalidated when points change
+_user_cache = TTLCache(maxsize=5000, ttl=10)
+_user_cache_lock = threading.Lock()
+
+# failed logins per (ip, email) as a one-item list, counted in place so the 60s window
+# runs from the first failure and later failures can't extend it
+MAX_LOGIN_FAILURES = 5
+_login_failures = TTLCache(maxsize=10000, ttl=60)
+_login_failures_lock = threading.Lock()
+
+_ph = PasswordHasher(time_cost=2, memory_cost=65536, parallelism=1)
+
+# idle long-lived connections, reused across requests so sqlite's page cache stays warm.
+# A connection is borrowed by one worker-thread call at a time, hence check_same_thread=False.
+_pool = queue.LifoQueue(maxsize=POOL_SIZE)
+
+def connect_db():
+    # room for every distinct statement the app issues in the per-connection statement cache
+    db = sqlite3.connect(DB, check_same_thread=False, cached_statements=256)
+    db.row_factory = sqlite3.Row
+    apply_pragmas(db)
+    db.execute('PRAGMA cache_size=-20000')
     return db
 
+@contextmanager
+def pooled_db():
+    """Borrows a pooled connection for the duration of the block.
+
+    Borrowing and returning happen in the thread doing the sqlite work, never via the
+    request context: a cancelled request must not release a connection still in use.
+    """
+    try:
+        db = _pool.get_nowait()
+    except queue.Empty:
+        db = connect_db()
+    try:
+        yield db
+    finally:
+        # never hand a connection back with a transaction still open on it
+        if db.in_transaction:
+            db.rollback()
+        try:
+            _pool.put_nowait(db)
+        except queue.Full:
+            db.close()
+
+@atexit.register
+def close_pool():
+    while True:
+        try:
+            _pool.get_nowait().close()
+        except queue.Empty:
+            break
+
 def query_db(query, args=(), one=False):
-    cur = get_db().execute(query, args)
-    rv = cur.fetchall()
-    cur.close()
+    with pooled_db() as db:
+        cur = db.execute(query, args)
+        rv = cur.fetchall()
+        cur.close()
     return (rv[0] if rv else None) if one else rv
 
 def execute_db(query, args=()):
-    cur = get_db().execute(query, args)
-    get_db().commit()
-    lastrowid = cur.lastrowid
-    cur.close()
+    with pooled_db() as db:
+        cur = db.execute(query, args)
+        db.commit()
+        lastrowid = cur.lastrowid
+        cur.close()
     return lastrowid
 
-app = Flask(__name__)
-CORS(app)
+class ORJSONProvider(DefaultJSONProvider):
+    # orjson serializes several times faster than the stdlib json module;
+    # responses are compact and unsorted, which is all the frontend needs
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default).decode()
 
-@app.teardown_appcontext
-def close_connection(exception):
-    db = getattr(g, '_database', None)
-    if db is not None:
-        db.close()
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, default=self.default), mimetype=self.mimetype)
+
+app = Quart(__name__)
+app.json = ORJSONProvider(app)
+app = cors(app)
+
+@app.before_serving
+async def configure_threadpool():
+    # handlers await blocking work via asyncio.to_thread, which uses the loop's default executor
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=THREADPOOL_SIZE))
+
+def encode_token(payload):
+    signing_input = _jwt_header + b'.' + base64url_encode(json.dumps(payload, separators=(',', ':')).encode())
+    return (signing_input + b'.' + base64url_encode(_jwt_alg.sign(signing_input, _jwt_key))).decode()
+
+def decode_token(token):
+    """Returns the verified claims; raises a jwt.InvalidTokenError subclass otherwise."""
+    try:
+        header, payload, signature = token.encode().split(b'.')
+    except ValueError:
+        raise jwt.DecodeError('Not enough segments')
+    # anything not signed with our exact header (alg included) is rejected outright
+    if header != _jwt_header:
+        raise jwt.InvalidAlgorithmError('Unexpected token header')
+    try:
+        signature = base64url_decode(signature)
+    except Exception:
+        raise jwt.DecodeError('Invalid signature padding')
+    if not _jwt_alg.verify(header + b'.' + payload, _jwt_key, signature):
+        raise jwt.InvalidSignatureError('Signature verification failed')
+    try:
+        claims = json.loads(base64url_decode(payload))
+    except Exception:
+        raise jwt.DecodeError('Invalid payload')
+    if not isinstance(claims, dict) or not isinstance(claims.get('exp'), (int, float)):
+        raise jwt.DecodeError('Invalid payload')
+    if claims['exp'] <= time.time():
+        raise jwt.ExpiredSignatureError('Signature has expired')
+    return claims
 
 def make_token(user_id, expires_minutes=60*24*7):
-    exp = datetime.utcnow() + timedelta(minutes=expires_minutes)
+    exp = int(time.time()) + expires_minutes * 60
     # JWT spec expects subject/sub to be a string. Store as string to keep PyJWT happy.
     payload = { 'sub': str(user_id), 'exp': exp }
-    return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGO)
+    return encode_token(payload)
 
 def verify_token(token):
+    # cheap structural check so junk Authorization headers never reach hashing or crypto
+    if len(token) >= MAX_TOKEN_LENGTH or token.count('.') != 2:
+        return None
+    key = hashlib.sha256(token.encode()).digest()
+    with _jwt_cache_lock:
+        hit = _jwt_cache.get(key)
+    if hit is not None:
+        user_id, exp = hit
+        # the cache ttl may outlive the token, so always honor exp
+        if exp > time.time():
+            return user_id
+        with _jwt_cache_lock:
+            _jwt_cache.pop(key, None)
+        return None
+
     try:
-        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGO])
+        payload = decode_token(token)
         sub = payload.get('sub')
         # convert to integer id when possible
         try:
-            return int(sub)
+            user_id = int(sub)
         except Exception:
             return None
     except Exception:
         return None
 
+    with _jwt_cache_lock:
+        _jwt_cache[key] = (user_id, payload['exp'])
+    return user_id
+
+def hash_password(password):
+    return _ph.hash(password)
+
+def verify_password(stored_hash, password):
+    """Returns (ok, new_hash); new_hash is set when the stored hash should be upgraded."""
+    if stored_hash.startswith('$argon2'):
+        try:
+            _ph.verify(stored_hash, password)
+        except (VerificationError, InvalidHashError):
+            return False, None
+        return True, (hash_password(password) if _ph.check_needs_rehash(stored_hash) else None)
+    # legacy werkzeug (pbkdf2:/scrypt:) hash, migrated to argon2 on success
+    if not check_password_hash(stored_hash, password):
+        return False, None
+    return True, hash_password(password)
+
 def auth_required(fn):
     from functools import wraps
     @wraps(fn)
-    def wrapper(*args, **kwargs):
+    async def wrapper(*args, **kwargs):
         auth = request.headers.get('Authorization', '')
         if auth.startswith('Bearer '):
             token = auth.split(' ', 1)[1]
             user_id = verify_token(token)
             if user_id:
-                # load user
-                user = query_db('SELECT id, username, email, points FROM users WHERE id = ?', (user_id,), one=True)
+                # load user, from the short-lived cache when possible
+                with _user_cache_lock:
+                    user = _user_cache.get(user_id)
+                if user is None:
+                    row = await asyncio.to_thread(query_db, USER_BY_ID_SQL, (user_id,), one=True)
+                    if row:
+                        user = dict(row)
+                        with _user_cache_lock:
+                            _user_cache[user_id] = user
                 if user:
                     g.current_user = user
-                    return fn(*args, **kwargs)
+                    return await fn(*args, **kwargs)
         return jsonify({'error': 'Unauthorized'}), 401
     return wrapper
 
+async def body():
+    """Parsed JSON object body, or {} when the body is missing, malformed or not an object."""
+    data = await request.get_json(silent=True)
+    return data if isinstance(data, dict) else {}
+
+def valid_credentials(email, password):
+    """Shape rules for new accounts; older accounts may predate the email and max-length checks."""
+    return 6 <= len(password) <= 256 and '@' in email and len(email) <= 320
+
+def create_user(username, email, password_hash):
+    """Inserts the user and returns its public row, or None if the email/username is taken."""
+    # the UNIQUE constraints decide atomically, with no separate existence check
+    with pooled_db() as db, db:
+        return db.execute(
+            'INSERT INTO users (username, email, password_hash) VALUES (?, ?, ?) '
+            'ON CONFLICT DO NOTHING RETURNING id, username, email, points',
+            (username, email, password_hash),
+        ).fetchone()
+
 @app.route('/api/register', methods=['POST'])
-def register():
-    data = request.json or {}
+async def register():
+    data = await body()
     username = (data.get('username') or '').strip()
     email = (data.get('email') or '').strip().lower()
     password = data.get('password') or ''
 
-    if not username or not email or not password or len(password) < 6:
-        return jsonify({'error': 'Invalid input, provide username, email and password (min 6 chars)'}), 400
+    if not username or not valid_credentials(email, password):
+        return jsonify({'error': 'Invalid input, provide username, a valid email and password (6-256 chars)'}), 400
 
-    # check exists
-    existing = query_db('SELECT id FROM users WHERE email = ? OR username = ?', (email, username), one=True)
-    if existing:
+    password_hash = await asyncio.to_thread(hash_password, password)
+    row = await asyncio.to_thread(create_user, username, email, password_hash)
+    if row is None:
         return jsonify({'error': 'User with that email or username already exists'}), 400
-
-    password_hash = generate_password_hash(password)
-    user_id = execute_db('INSERT INTO users (username, email, password_hash) VALUES (?, ?, ?)', (username, email, password_hash))
+    user_id, username, email, points = row
 
     token = make_token(user_id)
-    user = query_db('SELECT id, username, email, points FROM users WHERE id = ?', (user_id,), one=True)
-    return jsonify({'token': token, 'user': dict(user)})
+    return jsonify({'token': token, 'user': {'id': user_id, 'username': username, 'email': email, 'points': points}})
+
+def record_login_failure(key):
+    with _login_failures_lock:
+        entry = _login_failures.get(key)
+        if entry is None:
+            _login_failures[key] = [1]
+        else:
+            entry[0] += 1
 
 @app.route('/api/login', methods=['POST'])
-def login():
-    data = request.json or {}
+async def login():
+    data = await body()
     email = (data.get('email') or '').strip().lower()
     password = data.get('password') or ''
     if not email or not password:
         return jsonify({'error': 'Missing email/password'}), 400
+    # registration has always required 6+ chars, so a shorter password can't match any
+    # stored hash; skip the hashing work. Other register rules (email shape, max length)
+    # are newer and existing accounts may not satisfy them, so they aren't checked here.
+    if len(password) < 6:
+        return jsonify({'error': 'Invalid credentials'}), 401
 
-    user = query_db('SELECT id, username, email, password_hash, points FROM users WHERE email = ?', (email,), one=True)
-    if not user:
+    failure_key = (request.remote_addr, email)
+    with _login_failures_lock:
+        failures = _login_failures.get(failure_key)
+    if failures is not None and failures[0] >= MAX_LOGIN_FAILURES:
         return jsonify({'error': 'Invalid credentials'}), 401
 
-    if not check_password_hash(user['password_hash'], password):
+    row = await asyncio.to_thread(query_db, 'SELECT id, username, email, password_hash, points FROM users WHERE email = ?', (email,), one=True)
+    if not row:
+        record_login_failure(failure_key)
         return jsonify({'error': 'Invalid credentials'}), 401
+    user_id, username, email, password_hash, points = row
 
-    token = make_token(user['id'])
-    return jsonify({'token': token, 'user': dict({k: user[k] for k in user.keys() if k != 'password_hash'})})
+    ok, new_hash = await asyncio.to_thread(verify_password, password_hash, password)
+    if not ok:
+        record_login_failure(failure_key)
+        return jsonify({'error': 'Invalid credentials'}), 401
+    with _login_failures_lock:
+        _login_failures.pop(failure_key, None)
+    if new_hash:
+        await asyncio.to_thread(execute_db, 'UPDATE users SET password_hash = ? WHERE id = ?', (new_hash, user_id))
+
+    token = make_token(user_id)
+    return jsonify({'token': token, 'user': {'id': user_id, 'username': username, 'email': email, 'points': points}})
 
 @app.route('/api/me', methods=['GET'])
 @auth_required
-def me():
+async def me():
     user = g.current_user
-    # fetch completed courses and ratings
-    completions = query_db('SELECT course_id, completed_at FROM completions WHERE user_id = ?', (user['id'],))
-    ratings = query_db('SELECT course_id, rating FROM ratings WHERE user_id = ?', (user['id'],))
-    return jsonify({'user': dict(user), 'completions': [dict(r) for r in completions], 'ratings': [dict(r) for r in ratings]})
+    # fetch completed courses and ratings in one roundtrip, split by kind
+    rows = await asyncio.to_thread(query_db, USER_ACTIVITY_SQL, (user['id'], user['id']))
+    completions = [{'course_id': r['course_id'], 'completed_at': r['ts']} for r in rows if r['kind'] == 'c']
+    ratings = [{'course_id': r['course_id'], 'rating': r['rating']} for r in rows if r['kind'] == 'r']
+    return jsonify({'user': user, 'completions': completions, 'ratings': ratings})
+
+def award_completion(user_id, course_id):
+    """Records the completion; the trg_award_points trigger adds the points.
+
+    Returns the updated public user row, or None if the course was already completed.
+    """
+    with pooled_db() as db:
+        # the UNIQUE constraint doubles as the "already completed" check
+        with db:
+            cur = db.execute('INSERT OR IGNORE INTO completions (user_id, course_id) VALUES (?, ?)', (user_id, course_id))
+            if cur.rowcount == 0:
+                return None
+        return db.execute(USER_BY_ID_SQL, (user_id,)).fetchone()
 
 @app.route('/api/complete_course', methods=['POST'])
 @auth_required
-def complete_course():
-    data = request.json or {}
+async def complete_course():
+    data = await body()
     course_id = data.get('course_id')
     if not course_id:
         return jsonify({'error': 'Missing course_id'}), 400
 
     user = g.current_user
-    # check existing completion
-    existing = query_db('SELECT id FROM completions WHERE user_id = ? AND course_id = ?', (user['id'], course_id), one=True)
-    if existing:
-        return jsonify({'message': 'Already completed', 'user': dict(user)}), 200
+    updated = await asyncio.to_thread(award_completion, user['id'], course_id)
+    if updated is None:
+        return jsonify({'message': 'Already completed', 'user': user}), 200
 
-    execute_db('INSERT INTO completions (user_id, course_id) VALUES (?, ?)', (user['id'], course_id))
-    # award points per course, configurable: 100 points per course
-    points_awarded = 100
-    execute_db('UPDATE users SET points = points + ? WHERE id = ?', (points_awarded, user['id']))
-    # return updated user
-    updated = query_db('SELECT id, username, email, points FROM users WHERE id = ?', (user['id'],), one=True)
-    return jsonify({'message': 'Course completed', 'points_awarded': points_awarded, 'user': dict(updated)})
+    user_id, username, email, points = updated
+    updated = {'id': user_id, 'username': username, 'email': email, 'points': points}
+    with _user_cache_lock:
+        _user_cache[user['id']] = updated
+    return jsonify({'message': 'Course completed', 'points_awarded': POINTS_PER_COURSE, 'user': updated})
 
 @app.route('/api/rate_course', methods=['POST'])
 @auth_required
-def rate_course():
-    data = request.json or {}
+async def rate_course():
+    data = await body()
     course_id = data.get('course_id')
     rating = int(data.get('rating') or 0)
     if not course_id or rating < 1 or rating > 5:
@@ -156,55 +388,67 @@ def rate_course():
 
     user = g.current_user
     # upsert rating
-    existing = query_db('SELECT id FROM ratings WHERE user_id = ? AND course_id = ?', (user['id'], course_id), one=True)
+    existing = await asyncio.to_thread(query_db, 'SELECT id FROM ratings WHERE user_id = ? AND course_id = ?', (user['id'], course_id), one=True)
     if existing:
-        execute_db('UPDATE ratings SET rating = ?, created_at = CURRENT_TIMESTAMP WHERE id = ?', (rating, existing['id']))
+        await asyncio.to_thread(execute_db, 'UPDATE ratings SET rating = ?, created_at = CURRENT_TIMESTAMP WHERE id = ?', (rating, existing['id']))
     else:
-        execute_db('INSERT INTO ratings (user_id, course_id, rating) VALUES (?, ?, ?)', (user['id'], course_id, rating))
+        await asyncio.to_thread(execute_db, 'INSERT INTO ratings (user_id, course_id, rating) VALUES (?, ?, ?)', (user['id'], course_id, rating))
 
     # compute new average & count
-    avg = query_db('SELECT AVG(rating) as avg_rating, COUNT(*) as count FROM ratings WHERE course_id = ?', (course_id,), one=True)
+    avg = await asyncio.to_thread(query_db, 'SELECT AVG(rating) as avg_rating, COUNT(*) as count FROM ratings WHERE course_id = ?', (course_id,), one=True)
     return jsonify({'message': 'Rating saved', 'average': avg['avg_rating'], 'count': avg['count']})
 
-@app.route('/api/courses', methods=['GET'])
-def courses():
-    # return courses.json merged with average rating, and optionally user completion if authorized
-    import json
-    path = os.path.join(os.path.dirname(__file__), '..', 'src', 'data', 'courses.json')
+def load_courses():
+    global _courses_cache, _courses_mtime
     try:
-        with open(path, 'r') as f:
-            courses = json.load(f)
+        mtime = os.stat(COURSES_PATH).st_mtime
+        if _courses_cache is None or mtime != _courses_mtime:
+            with open(COURSES_PATH, 'r') as f:
+                _courses_cache = json.load(f)
+            _courses_mtime = mtime
     except Exception:
-        courses = []
-
-    # compute avg ratings for all courses
-    out = []
-    for c in courses:
-        r = query_db('SELECT AVG(rating) as avg_rating, COUNT(*) as count FROM ratings WHERE course_id = ?', (c['id'],), one=True)
-        c_copy = c.copy()
-        c_copy['avg_rating'] = float(r['avg_rating']) if r and r['avg_rating'] is not None else None
-        c_copy['rating_count'] = int(r['count']) if r else 0
-        out.append(c_copy)
-
-    # if authorization header exists and valid, add completion flags
+        return []
+    return _courses_cache
+
+@app.route('/api/courses', methods=['GET'])
+async def courses():
+    # return courses.json merged with average rating, and optionally user completion if authorized
+    courses = await asyncio.to_thread(load_courses)
+
+    # if authorization header exists and valid, collect completion flags
+    completed_set = None
     auth = request.headers.get('Authorization', '')
     if auth.startswith('Bearer '):
         token = auth.split(' ', 1)[1]
         uid = verify_token(token)
         if uid:
-            user_comps = query_db('SELECT course_id FROM completions WHERE user_id = ?', (uid,))
+            user_comps = await asyncio.to_thread(query_db, 'SELECT course_id FROM completions WHERE user_id = ?', (uid,))
             completed_set = {r['course_id'] for r in user_comps}
-            for c in out:
-                c['completed'] = c['id'] in completed_set
+
+    # compute avg ratings for all courses in a single grouped query
+    rows = await asyncio.to_thread(query_db, RATINGS_AGG_SQL)
+    # AVG() is always REAL and COUNT() an integer, so the values can go out as-is
+    agg = {r['course_id']: {'avg_rating': r['avg_rating'], 'rating_count': r['count']} for r in rows}
+    unrated = {'avg_rating': None, 'rating_count': 0}
+
+    # build each response dict in one go; the cached course dicts are never mutated
+    if completed_set is None:
+        out = [{**c, **agg.get(c['id'], unrated)} for c in courses]
+    else:
+        out = [{**c, **agg.get(c['id'], unrated), 'completed': c['id'] in completed_set} for c in courses]
 
     return jsonify(out)
 
-if __name__ == '__main__':
-    # ensure db exists
+def ensure_db():
     if not os.path.exists(DB):
         print('DB missing, initializing...')
-        from db_init import init_db
-        init_db()
+    # init_db is idempotent, so existing databases also pick up new indexes and triggers
+    from db_init import init_db
+    init_db()
+
+if __name__ == '__main__':
+    # development server only; see asgi.py for running under hypercorn
+    ensure_db()
 
     port = int(os.environ.get('PORT', 5000))
     app.run(host='0.0.0.0', port=port)
@@ -0,0 +1,8 @@
+# ASGI entry point for production, run with:
+#   hypercorn -w $(nproc) -b 0.0.0.0:5000 asgi:app
+#
+# Every worker process keeps its own connection pool and token/user caches;
+# sqlite in WAL mode handles concurrent readers across processes.
+from app import app, ensure_db
+
+ensure_db()
@@ -1,10 +1,28 @@
+import os
 import sqlite3
 from datetime import datetime
 
-DB = 'app.db'
+DB = os.environ.get('SQLITE_DB', 'app.db')
+# points awarded per completed course, maintained by the trg_award_points trigger
+POINTS_PER_COURSE = 100
+
+# WAL lets readers proceed while a write commits; NORMAL sync is safe under WAL
+PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA mmap_size=268435456',
+    'PRAGMA foreign_keys=ON',
+    'PRAGMA wal_autocheckpoint=1000',
+)
+
+def apply_pragmas(conn):
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
 
 def init_db():
     conn = sqlite3.connect(DB)
+    apply_pragmas(conn)
     c = conn.cursor()
 
     # users table
@@ -42,6 +60,24 @@ def init_db():
     )
     ''')
 
+    # the UNIQUE(user_id, course_id) constraints already index per-user lookups;
+    # per-course rating aggregation needs its own (covering) index
+    c.execute('CREATE INDEX IF NOT EXISTS idx_ratings_course ON ratings(course_id, rating)')
+
+    # award points in the same statement that records a completion; recreated on every
+    # init so the baked-in amount always matches POINTS_PER_COURSE. Drop and create
+    # share one write transaction: every worker runs init_db at startup, and no
+    # completion may commit while the trigger is missing.
+    conn.commit()
+    c.execute('BEGIN IMMEDIATE')
+    c.execute('DROP TRIGGER IF EXISTS trg_award_points')
+    c.execute(f'''
+    CREATE TRIGGER trg_award_points AFTER INSERT ON completions
+    BEGIN
+      UPDATE users SET points = points + {POINTS_PER_COURSE} WHERE id = NEW.user_id;
+    END
+    ''')
+
     conn.commit()
     conn.close()
 
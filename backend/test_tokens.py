@@ -0,0 +1,92 @@
+# Regression checks for the hand-rolled HS256 encode/decode in app.py.
+# Run from backend/:  python -m pytest test_tokens.py
+import json
+import time
+
+import jwt
+import pytest
+from jwt.utils import base64url_encode
+
+from app import JWT_SECRET, decode_token, make_token, verify_token
+
+
+def _b64json(obj):
+    return base64url_encode(json.dumps(obj, separators=(',', ':')).encode()).decode()
+
+
+def _claims(exp_in=60, sub='1'):
+    return {'sub': sub, 'exp': int(time.time()) + exp_in}
+
+
+def test_pyjwt_token_verifies():
+    token = jwt.encode(_claims(sub='42'), JWT_SECRET, algorithm='HS256')
+    assert decode_token(token)['sub'] == '42'
+    assert verify_token(token) == 42
+
+
+def test_issued_token_verifies_with_pyjwt():
+    token = make_token(7)
+    assert jwt.decode(token, JWT_SECRET, algorithms=['HS256'])['sub'] == '7'
+    assert verify_token(token) == 7
+
+
+def test_alg_none_rejected():
+    token = jwt.encode(_claims(), None, algorithm='none')
+    with pytest.raises(jwt.InvalidTokenError):
+        decode_token(token)
+    assert verify_token(token) is None
+
+
+@pytest.mark.parametrize('algorithm', ['HS384', 'HS512'])
+def test_resigned_header_rejected(algorithm):
+    token = jwt.encode(_claims(), JWT_SECRET, algorithm=algorithm)
+    with pytest.raises(jwt.InvalidTokenError):
+        decode_token(token)
+    assert verify_token(token) is None
+
+
+def test_reordered_header_rejected():
+    # same alg, different header bytes, validly signed over those bytes
+    token = jwt.encode(_claims(), JWT_SECRET, algorithm='HS256', headers={'kid': 'x'})
+    with pytest.raises(jwt.InvalidTokenError):
+        decode_token(token)
+
+
+def test_tampered_payload_rejected():
+    header, _, signature = make_token(1).split('.')
+    token = '.'.join([header, _b64json(_claims(sub='2')), signature])
+    with pytest.raises(jwt.InvalidSignatureError):
+        decode_token(token)
+    assert verify_token(token) is None
+
+
+def test_wrong_secret_rejected():
+    token = jwt.encode(_claims(), 'not-the-secret', algorithm='HS256')
+    with pytest.raises(jwt.InvalidSignatureError):
+        decode_token(token)
+
+
+def test_bad_signature_padding_rejected():
+    header, payload, _ = make_token(1).split('.')
+    token = '.'.join([header, payload, 'abcde'])
+    with pytest.raises(jwt.InvalidTokenError):
+        decode_token(token)
+    assert verify_token(token) is None
+
+
+def test_expired_token_rejected():
+    token = jwt.encode(_claims(exp_in=-1), JWT_SECRET, algorithm='HS256')
+    with pytest.raises(jwt.ExpiredSignatureError):
+        decode_token(token)
+    assert verify_token(token) is None
+
+
+def test_missing_exp_rejected():
+    token = jwt.encode({'sub': '1'}, JWT_SECRET, algorithm='HS256')
+    with pytest.raises(jwt.InvalidTokenError):
+        decode_token(token)
+
+
+@pytest.mark.parametrize('token', ['', 'a.b', 'a.b.c', 'a.b.c.d', 'x' * 600])
+def test_malformed_tokens_rejected(token):
+    assert verify_token(token) is None